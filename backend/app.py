@@ -1,8 +1,15 @@
 import datetime
+import functools
+import itertools
 import os
+import re
+import threading
+import time
 import traceback
 
-from flask import Flask, jsonify, request
+import MySQLdb
+import MySQLdb.cursors
+from flask import Flask, g, jsonify, request
 from flask_mysqldb import MySQL
 
 app = Flask(__name__)
@@ -14,8 +21,317 @@ app.config["MYSQL_PASSWORD"] = os.environ.get("MYSQL_PASSWORD", "admin")
 app.config["MYSQL_DB"] = os.environ.get("MYSQL_DB", "habit_tracker")
 app.config["MYSQL_CURSORCLASS"] = "DictCursor"
 
+# Réplicas de leitura opcionais: lista "host[:porta]" separada por vírgulas.
+# Vazio = todas as rotas usam apenas o primário (MYSQL_HOST).
+app.config["MYSQL_REPLICA_HOSTS"] = os.environ.get("MYSQL_REPLICA_HOSTS", "")
+app.config["MYSQL_REPLICA_CONNECT_TIMEOUT"] = int(
+    os.environ.get("MYSQL_REPLICA_CONNECT_TIMEOUT", "1")
+)
+# Segundos fora do rodízio após falha de conexão com a réplica
+app.config["MYSQL_REPLICA_RETRY_INTERVAL"] = float(
+    os.environ.get("MYSQL_REPLICA_RETRY_INTERVAL", "30")
+)
+
+# Controle de admissão das leituras pesadas (/habits, /export_data)
+app.config["HEAVY_READS_MAX_CONCURRENT"] = int(
+    os.environ.get("HEAVY_READS_MAX_CONCURRENT", "4")
+)
+app.config["HEAVY_READS_MAX_QUEUE"] = int(os.environ.get("HEAVY_READS_MAX_QUEUE", "16"))
+app.config["HEAVY_READS_QUEUE_TIMEOUT"] = float(
+    os.environ.get("HEAVY_READS_QUEUE_TIMEOUT", "5")
+)
+
 mysql = MySQL(app)
 
+CONSISTENCY_TOKEN_HEADER = "X-Consistency-Token"
+# Conjunto de GTIDs: "uuid:1-5:7,uuid:tag:1-3" (tags a partir do MySQL 8.3)
+_GTID_SET_RE = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"(:([A-Za-z_][A-Za-z0-9_]{0,31}|[0-9]+(-[0-9]+)?))+"
+)
+
+
+def parse_replica_hosts(raw):
+    replicas = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.partition(":")
+        replicas.append((host, int(port) if port else 3306))
+    return replicas
+
+
+_replica_lock = threading.Lock()
+# Última posição (GTID) escrita por este processo no primário. Usada quando o
+# cliente não envia o token, garantindo read-your-writes sem mudar o app.
+_last_write_gtid = ""
+# Se a posição da última escrita não pôde ser obtida (gtid_mode=OFF ou erro na
+# consulta), não há como saber se uma réplica já a aplicou: lê do primário até
+# a próxima escrita com posição conhecida.
+_last_write_unknown = False
+
+
+def configure_replicas(raw):
+    global replica_hosts, _replica_cycle, _replica_skip_until
+    replica_hosts = parse_replica_hosts(raw)
+    _replica_cycle = itertools.cycle(range(len(replica_hosts)))
+    # Réplica que falhou ao conectar fica fora do rodízio até este instante
+    _replica_skip_until = [0.0] * len(replica_hosts)
+
+
+configure_replicas(app.config["MYSQL_REPLICA_HOSTS"])
+
+
+def connect_replica(host, port):
+    return MySQLdb.connect(
+        host=host,
+        port=port,
+        user=app.config["MYSQL_USER"],
+        passwd=app.config["MYSQL_PASSWORD"],
+        db=app.config["MYSQL_DB"],
+        cursorclass=MySQLdb.cursors.DictCursor,
+        connect_timeout=app.config["MYSQL_REPLICA_CONNECT_TIMEOUT"],
+    )
+
+
+def replica_caught_up(connection, required_gtid):
+    cursor = connection.cursor()
+    cursor.execute(
+        "SELECT GTID_SUBSET(%s, @@GLOBAL.gtid_executed) AS caught_up",
+        (required_gtid,),
+    )
+    row = cursor.fetchone()
+    cursor.close()
+    return bool(row and row["caught_up"])
+
+
+def is_gtid_set(value):
+    return all(_GTID_SET_RE.fullmatch(part.strip()) for part in value.split(","))
+
+
+def pick_replica(required_gtid):
+    now = time.monotonic()
+    with _replica_lock:
+        start = next(_replica_cycle)
+    for offset in range(len(replica_hosts)):
+        index = (start + offset) % len(replica_hosts)
+        if _replica_skip_until[index] > now:
+            continue
+        host, port = replica_hosts[index]
+        try:
+            replica = connect_replica(host, port)
+        except MySQLdb.Error:
+            traceback.print_exc()
+            _replica_skip_until[index] = now + app.config["MYSQL_REPLICA_RETRY_INTERVAL"]
+            continue
+        try:
+            if not required_gtid or replica_caught_up(replica, required_gtid):
+                return replica, f"replica:{host}:{port}"
+        except MySQLdb.Error:
+            # Falha na checagem não indica réplica fora do ar: só esta leitura
+            # vai para o primário
+            traceback.print_exc()
+            replica.close()
+            return None, None
+        # Atrasada em relação a esta posição: tenta a próxima, sem penalizar a
+        # réplica para leituras que exigem posições mais antigas
+        replica.close()
+    return None, None
+
+
+def read_connection():
+    # Conexão para rotas GET: réplica (round-robin) se ela já aplicou as escritas
+    # que o cliente viu; caso contrário, ou em qualquer falha, usa o primário.
+    if "read_connection" in g:
+        return g.read_connection
+
+    connection = None
+    g.read_source = "primary"
+    if replica_hosts and not _last_write_unknown:
+        token = request.headers.get(CONSISTENCY_TOKEN_HEADER, "").strip()
+        if not token or is_gtid_set(token):
+            connection, source = pick_replica(token or _last_write_gtid)
+            if connection is not None:
+                g.replica_connection = connection
+                g.read_source = source
+
+    if connection is None:
+        connection = mysql.connection
+    g.read_connection = connection
+    return connection
+
+
+def commit_primary():
+    global _last_write_gtid, _last_write_unknown, _data_version
+    mysql.connection.commit()
+    gtid = ""
+    if replica_hosts:
+        try:
+            cursor = mysql.connection.cursor()
+            cursor.execute("SELECT @@GLOBAL.gtid_executed AS gtid_executed")
+            row = cursor.fetchone()
+            cursor.close()
+            gtid = ((row and row["gtid_executed"]) or "").replace("\n", "")
+        except MySQLdb.Error:
+            traceback.print_exc()
+    # A versão dos dados só avança junto com a posição da escrita: uma leitura
+    # com a versão nova nunca escolhe réplica usando a posição antiga.
+    with _replica_lock:
+        if replica_hosts:
+            if gtid:
+                _last_write_gtid = gtid
+                _last_write_unknown = False
+                g.consistency_token = gtid
+            else:
+                _last_write_unknown = True
+        _data_version += 1
+
+
+# Single-flight: requisições idênticas concorrentes (mesma rota, argumentos e
+# versão dos dados) compartilham uma única execução da consulta.
+_data_version = 0
+_flights_lock = threading.Lock()
+_in_flight = {}
+_heavy_slots = threading.BoundedSemaphore(app.config["HEAVY_READS_MAX_CONCURRENT"])
+_heavy_waiting = 0
+coalescing_stats = {
+    "executed": 0,
+    "coalesced": 0,
+    "rejected": 0,
+    "in_flight": 0,
+    "queued": 0,
+}
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+def _acquire_heavy_slot():
+    global _heavy_waiting
+    if _heavy_slots.acquire(blocking=False):
+        return True
+    with _flights_lock:
+        if _heavy_waiting >= app.config["HEAVY_READS_MAX_QUEUE"]:
+            return False
+        _heavy_waiting += 1
+        coalescing_stats["queued"] += 1
+    try:
+        return _heavy_slots.acquire(timeout=app.config["HEAVY_READS_QUEUE_TIMEOUT"])
+    finally:
+        with _flights_lock:
+            _heavy_waiting -= 1
+
+
+def coalescing_key():
+    # O token do cliente entra na chave porque define de qual nó a leitura pode
+    # vir. _data_version e _last_write_gtid são lidos juntos (commit_primary os
+    # atualiza sob o mesmo lock), então o líder de um voo com esta versão exige
+    # ao menos esta posição; um token igual a ela não exige nada a mais e é
+    # normalizado, e esses clientes compartilham o mesmo voo. Tokens diferentes
+    # (ex.: vindos de outro processo) ficam em voos separados: custo aceito para
+    # não servir a um cliente um resultado anterior à escrita que ele já viu.
+    with _replica_lock:
+        data_version = _data_version
+        last_write_gtid = _last_write_gtid
+    token = request.headers.get(CONSISTENCY_TOKEN_HEADER, "").strip()
+    if token == last_write_gtid:
+        token = ""
+    return (
+        request.path,
+        tuple(sorted(request.args.items(multi=True))),
+        token,
+        data_version,
+    )
+
+
+def coalesced(view):
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        key = coalescing_key()
+        with _flights_lock:
+            flight = _in_flight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _in_flight[key] = _Flight()
+            else:
+                coalescing_stats["coalesced"] += 1
+
+        if leader:
+            try:
+                if _acquire_heavy_slot():
+                    try:
+                        with _flights_lock:
+                            coalescing_stats["executed"] += 1
+                            coalescing_stats["in_flight"] += 1
+                        response = app.make_response(view(*args, **kwargs))
+                        flight.result = (
+                            response.get_data(),
+                            response.status_code,
+                            list(response.headers.items()),
+                            g.get("read_source"),
+                        )
+                    finally:
+                        _heavy_slots.release()
+                        with _flights_lock:
+                            coalescing_stats["in_flight"] -= 1
+            except Exception as e:
+                traceback.print_exc()
+                flight.error = e
+            finally:
+                with _flights_lock:
+                    _in_flight.pop(key, None)
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            # Cada requisição recebe sua própria resposta; a exceção não é
+            # relançada em várias threads ao mesmo tempo
+            return jsonify({"error": str(flight.error)}), 500
+        if flight.result is None:
+            # Sem vaga para executar: a requisição (e as que aguardavam) é descartada
+            with _flights_lock:
+                coalescing_stats["rejected"] += 1
+            response = jsonify({"error": "Servidor ocupado, tente novamente."})
+            response.status_code = 503
+            response.headers["Retry-After"] = "1"
+            return response
+        body, status, headers, read_source = flight.result
+        if read_source is not None:
+            g.read_source = read_source
+        return app.response_class(body, status=status, headers=headers)
+
+    return wrapper
+
+
+@app.route("/coalescing_stats", methods=["GET"])
+def get_coalescing_stats():
+    with _flights_lock:
+        stats = dict(coalescing_stats)
+    stats["data_version"] = _data_version
+    return jsonify(stats), 200
+
+
+@app.after_request
+def add_consistency_headers(response):
+    if "consistency_token" in g:
+        response.headers[CONSISTENCY_TOKEN_HEADER] = g.consistency_token
+    if "read_source" in g:
+        response.headers["X-Read-Source"] = g.read_source
+    return response
+
+
+@app.teardown_appcontext
+def close_replica_connection(exception):
+    replica = g.pop("replica_connection", None)
+    if replica is not None:
+        replica.close()
+
 
 def calculate_streak(completed_dates_raw):
     if not completed_dates_raw:
@@ -59,7 +375,7 @@ def calculate_streak(completed_dates_raw):
 @app.route("/categories", methods=["GET"])
 def get_all_categories():
     try:
-        cursor = mysql.connection.cursor()
+        cursor = read_connection().cursor()
         cursor.execute("SELECT id, name FROM categories ORDER BY name ASC")
         categories = cursor.fetchall()
         cursor.close()
@@ -106,7 +422,7 @@ def add_habit():
                     "INSERT INTO habit_categories (habit_id, category_id) VALUES (%s, %s)",
                     (habit_id, category_id),
                 )
-        mysql.connection.commit()
+        commit_primary()
         cursor.close()
         return jsonify({"message": "Habit added successfully!", "id": habit_id}), 201
     except KeyError as e:
@@ -119,9 +435,10 @@ def add_habit():
 
 
 @app.route("/habits", methods=["GET"])
+@coalesced
 def get_habits():
     try:
-        cursor = mysql.connection.cursor()
+        cursor = read_connection().cursor()
         today = datetime.date.today()
 
         # Determina o início do período (semana ou mês) com base no count_method (exemplo simplificado para semanal)
@@ -182,7 +499,7 @@ def get_habits():
 
 
 
-            streak_cursor = mysql.connection.cursor()
+            streak_cursor = read_connection().cursor()
             if habit["completion_method"] == "boolean":
                 streak_cursor.execute(
                     "SELECT DISTINCT record_date FROM habit_records WHERE habit_id = %s ORDER BY record_date DESC",
@@ -280,7 +597,7 @@ def update_habit(habit_id):
                         "INSERT INTO habit_categories (habit_id, category_id) VALUES (%s, %s)",
                         (habit_id, category_id),
                     )
-        mysql.connection.commit()
+        commit_primary()
         cursor.close()
         return jsonify(
             {"message": f"Habit with ID {habit_id} updated successfully!"}
@@ -296,7 +613,7 @@ def delete_habit(habit_id):
     try:
         cursor = mysql.connection.cursor()
         cursor.execute("DELETE FROM habits WHERE id = %s", (habit_id,))
-        mysql.connection.commit()
+        commit_primary()
         if cursor.rowcount == 0:
             cursor.close()
             return jsonify({"error": f"Habit with ID {habit_id} not found."}), 404
@@ -347,7 +664,7 @@ def add_habit_record():
             params = (habit_id, record_date_str, quantity_to_add)
 
         cursor.execute(sql, params)
-        mysql.connection.commit()
+        commit_primary()
         record_id = cursor.lastrowid
         cursor.close()
         return jsonify(
@@ -375,7 +692,7 @@ def delete_habit_record_today():
             "DELETE FROM habit_records WHERE habit_id = %s AND record_date = %s",
             (habit_id, record_date_str),
         )
-        mysql.connection.commit()
+        commit_primary()
         cursor.close()
         if result > 0:
             return jsonify(
@@ -402,7 +719,7 @@ def get_habit_records_for_heatmap(habit_id):
     try:
         start_date_str = request.args.get("start_date")
         end_date_str = request.args.get("end_date")
-        cursor = mysql.connection.cursor()
+        cursor = read_connection().cursor()
         query = "SELECT record_date, quantity_completed FROM habit_records WHERE habit_id = %s"
         params = [habit_id]
         if start_date_str:
@@ -433,7 +750,7 @@ def get_all_habit_records_for_heatmap():
     try:
         start_date_str = request.args.get("start_date")
         end_date_str = request.args.get("end_date")
-        cursor = mysql.connection.cursor()
+        cursor = read_connection().cursor()
         query = "SELECT habit_id, record_date, quantity_completed FROM habit_records"
         params = []
         where_clauses = []
@@ -464,9 +781,10 @@ def get_all_habit_records_for_heatmap():
 
 
 @app.route("/export_data", methods=["GET"])
+@coalesced
 def export_data():
     try:
-        cursor = mysql.connection.cursor()
+        cursor = read_connection().cursor()
 
         # Exportar Categorias
         cursor.execute("SELECT id, name FROM categories")
@@ -647,7 +965,7 @@ def import_data():
                         ),
                     )
 
-        mysql.connection.commit()
+        commit_primary()
         cursor.close()
         return jsonify({"message": "Dados importados com sucesso!"}), 201
 
@@ -674,7 +992,7 @@ def delete_all_data():
         )  # Decide se quer limpar categorias também
         # Se não quiser limpar categorias: cursor.execute("TRUNCATE TABLE categories") -> para resetar auto_increment se a tabela estiver vazia
         cursor.execute("SET FOREIGN_KEY_CHECKS=1")  # Reabilitar checagem de FK
-        mysql.connection.commit()
+        commit_primary()
         cursor.close()
         return jsonify({"message": "Todos os dados foram deletados com sucesso!"}), 200
     except Exception as e:
@@ -0,0 +1,335 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("MySQLdb")
+pytest.importorskip("flask_mysqldb")
+
+import app as app_module  # noqa: E402
+from flask import g, jsonify  # noqa: E402
+
+
+class SlowView:
+    # View de teste que só termina quando o teste libera
+    def __init__(self, error=None):
+        self.error = error
+        self.calls = 0
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        g.read_source = "replica:r1:3307"
+        response = jsonify({"calls": self.calls})
+        response.headers["X-Leader"] = "yes"
+        return response, 200
+
+
+@pytest.fixture(autouse=True)
+def coalescing_state(monkeypatch):
+    monkeypatch.setattr(app_module, "_in_flight", {})
+    monkeypatch.setattr(app_module, "_heavy_waiting", 0)
+    monkeypatch.setattr(app_module, "_data_version", 0)
+    monkeypatch.setattr(app_module, "_last_write_gtid", "")
+    monkeypatch.setattr(
+        app_module, "coalescing_stats", dict.fromkeys(app_module.coalescing_stats, 0)
+    )
+    monkeypatch.setitem(app_module.app.config, "HEAVY_READS_MAX_QUEUE", 16)
+    monkeypatch.setitem(app_module.app.config, "HEAVY_READS_QUEUE_TIMEOUT", 5)
+    set_max_concurrent(monkeypatch, 4)
+
+
+def set_max_concurrent(monkeypatch, limit):
+    monkeypatch.setattr(app_module, "_heavy_slots", threading.BoundedSemaphore(limit))
+
+
+def start_request(wrapped, results, url="/habits?category_id=1", headers=None):
+    def run():
+        with app_module.app.test_request_context(url, headers=headers):
+            response = app_module.app.make_response(wrapped())
+            results.append(app_module.app.process_response(response))
+
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread
+
+
+def wait_until(predicate, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+def test_identical_concurrent_requests_share_one_execution():
+    view = SlowView()
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    threads = [start_request(wrapped, results)]
+    view.started.wait(5)
+    threads += [start_request(wrapped, results) for _ in range(4)]
+    wait_until(lambda: app_module.coalescing_stats["coalesced"] == 4)
+    view.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert view.calls == 1
+    assert len(results) == 5
+    for response in results:
+        assert response.status_code == 200
+        assert response.get_json() == {"calls": 1}
+        assert response.headers["X-Leader"] == "yes"
+        assert response.headers["X-Read-Source"] == "replica:r1:3307"
+    assert app_module.coalescing_stats["executed"] == 1
+    assert app_module.coalescing_stats["coalesced"] == 4
+    assert app_module.coalescing_stats["rejected"] == 0
+
+
+def test_data_version_bump_starts_new_flight(monkeypatch):
+    view = SlowView()
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    first = start_request(wrapped, results)
+    view.started.wait(5)
+    monkeypatch.setattr(app_module, "_data_version", 1)
+    second = start_request(wrapped, results)
+    wait_until(lambda: view.calls == 2)
+    view.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert app_module.coalescing_stats["executed"] == 2
+    assert app_module.coalescing_stats["coalesced"] == 0
+
+
+def test_different_args_do_not_share_flight():
+    view = SlowView()
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    first = start_request(wrapped, results, url="/habits?category_id=1")
+    view.started.wait(5)
+    second = start_request(wrapped, results, url="/habits?category_id=2")
+    wait_until(lambda: view.calls == 2)
+    view.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert app_module.coalescing_stats["coalesced"] == 0
+
+
+def test_token_matching_last_write_shares_flight(monkeypatch):
+    monkeypatch.setattr(app_module, "_last_write_gtid", "uuid:1-9")
+    view = SlowView()
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    first = start_request(wrapped, results)
+    view.started.wait(5)
+    token = {app_module.CONSISTENCY_TOKEN_HEADER: "uuid:1-9"}
+    second = start_request(wrapped, results, headers=token)
+    wait_until(lambda: app_module.coalescing_stats["coalesced"] == 1)
+    view.release.set()
+    first.join(5)
+    second.join(5)
+
+    assert view.calls == 1
+
+
+def test_excess_request_is_shed_when_queue_is_full(monkeypatch):
+    set_max_concurrent(monkeypatch, 1)
+    monkeypatch.setitem(app_module.app.config, "HEAVY_READS_MAX_QUEUE", 0)
+    view = SlowView()
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    running = start_request(wrapped, results, url="/habits?category_id=1")
+    view.started.wait(5)
+    start_request(wrapped, results, url="/export_data").join(5)
+
+    shed = results.pop()
+    assert shed.status_code == 503
+    assert shed.headers["Retry-After"] == "1"
+    assert app_module.coalescing_stats["rejected"] == 1
+    assert app_module.coalescing_stats["queued"] == 0
+
+    view.release.set()
+    running.join(5)
+    assert results[0].status_code == 200
+
+
+def test_queued_request_is_rejected_after_timeout(monkeypatch):
+    set_max_concurrent(monkeypatch, 1)
+    monkeypatch.setitem(app_module.app.config, "HEAVY_READS_QUEUE_TIMEOUT", 0.05)
+    view = SlowView()
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    running = start_request(wrapped, results, url="/habits?category_id=1")
+    view.started.wait(5)
+    start_request(wrapped, results, url="/export_data").join(5)
+
+    assert results.pop().status_code == 503
+    assert app_module.coalescing_stats["queued"] == 1
+    assert app_module.coalescing_stats["rejected"] == 1
+
+    view.release.set()
+    running.join(5)
+
+
+def test_queued_request_runs_when_slot_frees(monkeypatch):
+    set_max_concurrent(monkeypatch, 1)
+    view = SlowView()
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    running = start_request(wrapped, results, url="/habits?category_id=1")
+    view.started.wait(5)
+    queued = start_request(wrapped, results, url="/export_data")
+    wait_until(lambda: app_module.coalescing_stats["queued"] == 1)
+    view.release.set()
+    running.join(5)
+    queued.join(5)
+
+    assert [response.status_code for response in results] == [200, 200]
+    assert app_module.coalescing_stats["executed"] == 2
+    assert app_module.coalescing_stats["rejected"] == 0
+
+
+def test_leader_error_gives_each_waiter_its_own_500():
+    view = SlowView(error=RuntimeError("boom"))
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    threads = [start_request(wrapped, results)]
+    view.started.wait(5)
+    threads += [start_request(wrapped, results) for _ in range(2)]
+    wait_until(lambda: app_module.coalescing_stats["coalesced"] == 2)
+    view.release.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert len(results) == 3
+    assert len({id(response) for response in results}) == 3
+    for response in results:
+        assert response.status_code == 500
+        assert response.get_json() == {"error": "boom"}
+
+
+class GapCursor:
+    # Cursor do primário cuja consulta de gtid_executed espera o teste liberar
+    def __init__(self, primary):
+        self.primary = primary
+
+    def execute(self, sql, params=()):
+        self.primary.in_gap.set()
+        self.primary.leave_gap.wait(5)
+
+    def fetchone(self):
+        return {"gtid_executed": self.primary.gtid_executed}
+
+    def close(self):
+        pass
+
+
+class GapPrimary:
+    def __init__(self, gtid_executed):
+        self.gtid_executed = gtid_executed
+        self.in_gap = threading.Event()
+        self.leave_gap = threading.Event()
+
+    def cursor(self):
+        return GapCursor(self)
+
+    def commit(self):
+        pass
+
+
+class LaggingReplica:
+    def __init__(self, applied):
+        self.applied = applied
+
+    def cursor(self):
+        replica = self
+
+        class Cursor:
+            def execute(self, sql, params=()):
+                self.row = {"caught_up": int(params[0] in replica.applied)}
+
+            def fetchone(self):
+                return self.row
+
+            def close(self):
+                pass
+
+        return Cursor()
+
+    def close(self):
+        pass
+
+
+def test_read_during_commit_gap_is_not_shared_with_writer(monkeypatch):
+    source_uuid = "3e11fa47-71ca-11e1-9e33-c80aa9429562"
+    old_gtid, new_gtid = f"{source_uuid}:1-5", f"{source_uuid}:1-6"
+    primary = GapPrimary(new_gtid)
+    monkeypatch.setattr(app_module, "mysql", SimpleNamespace(connection=primary))
+    monkeypatch.setattr(app_module, "_last_write_gtid", old_gtid)
+    monkeypatch.setattr(app_module, "_last_write_unknown", False)
+    monkeypatch.setattr(
+        app_module, "connect_replica", lambda host, port: LaggingReplica({old_gtid})
+    )
+    app_module.configure_replicas("r1:3307")
+
+    release = threading.Event()
+
+    def view():
+        release.wait(5)
+        app_module.read_connection()
+        return jsonify({"source": g.read_source}), 200
+
+    wrapped = app_module.coalesced(view)
+    results = []
+
+    # 1. O commit terminou, mas a posição da escrita ainda não foi registrada
+    tokens = {}
+
+    def write():
+        with app_module.app.test_request_context(method="POST"):
+            app_module.commit_primary()
+            tokens["writer"] = g.consistency_token
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    primary.in_gap.wait(5)
+
+    # 2. Uma leitura pesada começa nesse intervalo e fica em voo
+    stale = start_request(wrapped, results)
+    wait_until(lambda: len(app_module._in_flight) == 1)
+
+    # 3. O escritor recebe o token e relê: não pode entrar no voo antigo
+    primary.leave_gap.set()
+    writer.join(5)
+    assert tokens["writer"] == new_gtid
+    fresh = start_request(
+        wrapped, results, headers={app_module.CONSISTENCY_TOKEN_HEADER: new_gtid}
+    )
+    wait_until(lambda: len(app_module._in_flight) == 2)
+    release.set()
+    stale.join(5)
+    fresh.join(5)
+
+    # Nenhuma das leituras usa a réplica que ainda não tem a escrita
+    assert app_module.coalescing_stats["coalesced"] == 0
+    assert [response.get_json()["source"] for response in results] == [
+        "primary",
+        "primary",
+    ]
+    app_module.configure_replicas("")
@@ -0,0 +1,238 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("MySQLdb")
+pytest.importorskip("flask_mysqldb")
+
+import app as app_module  # noqa: E402
+
+SOURCE_UUID = "3e11fa47-71ca-11e1-9e33-c80aa9429562"
+OLD_GTID = f"{SOURCE_UUID}:1-5"
+NEW_GTID = f"{SOURCE_UUID}:1-9"
+
+
+class FakeCursor:
+    def __init__(self, connection):
+        self.connection = connection
+        self.row = None
+
+    def execute(self, sql, params=()):
+        if "GTID_SUBSET" in sql:
+            if self.connection.check_error is not None:
+                raise self.connection.check_error
+            self.row = {"caught_up": int(params[0] in self.connection.applied)}
+        elif "gtid_executed" in sql:
+            self.row = {"gtid_executed": self.connection.gtid_executed}
+
+    def fetchone(self):
+        return self.row
+
+    def fetchall(self):
+        return [{"id": 1, "name": self.connection.name}]
+
+    def close(self):
+        pass
+
+
+class FakeConnection:
+    # Stand-in de um servidor MySQL: "applied" são as posições GTID já aplicadas
+    def __init__(self, name, applied=(), gtid_executed=""):
+        self.name = name
+        self.applied = set(applied)
+        self.gtid_executed = gtid_executed
+        self.check_error = None
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        pass
+
+    def close(self):
+        pass
+
+
+@pytest.fixture
+def primary(monkeypatch):
+    connection = FakeConnection("primary", gtid_executed=NEW_GTID)
+    monkeypatch.setattr(app_module, "mysql", SimpleNamespace(connection=connection))
+    monkeypatch.setattr(app_module, "_last_write_gtid", "")
+    monkeypatch.setattr(app_module, "_last_write_unknown", False)
+    yield connection
+    app_module.configure_replicas("")
+
+
+@pytest.fixture
+def replicas(monkeypatch, primary):
+    servers = {}
+    connects = []
+
+    def fake_connect(host, port):
+        connects.append(host)
+        server = servers[host]
+        if server is None:
+            raise app_module.MySQLdb.Error("connection refused")
+        return server
+
+    monkeypatch.setattr(app_module, "connect_replica", fake_connect)
+    return SimpleNamespace(servers=servers, connects=connects)
+
+
+def get_read_source(headers=None):
+    response = app_module.app.test_client().get("/categories", headers=headers)
+    assert response.status_code == 200
+    return response.headers["X-Read-Source"]
+
+
+def test_without_replicas_reads_use_primary(primary):
+    app_module.configure_replicas("")
+    assert get_read_source() == "primary"
+
+
+def test_caught_up_replica_serves_read(monkeypatch, replicas):
+    app_module.configure_replicas("r1:3307")
+    replicas.servers["r1"] = FakeConnection("r1", applied={OLD_GTID})
+    monkeypatch.setattr(app_module, "_last_write_gtid", OLD_GTID)
+
+    assert get_read_source() == "replica:r1:3307"
+
+
+def test_lagging_replica_falls_back_to_primary(monkeypatch, replicas):
+    app_module.configure_replicas("r1:3307")
+    replicas.servers["r1"] = FakeConnection("r1", applied={OLD_GTID})
+    monkeypatch.setattr(app_module, "_last_write_gtid", NEW_GTID)
+
+    assert get_read_source() == "primary"
+    replicas.servers["r1"].applied.add(NEW_GTID)
+    assert get_read_source() == "replica:r1:3307"
+
+
+def test_token_ahead_of_replicas_does_not_block_other_reads(monkeypatch, replicas):
+    app_module.configure_replicas("r1:3307,r2:3308")
+    replicas.servers["r1"] = FakeConnection("r1", applied={OLD_GTID})
+    replicas.servers["r2"] = FakeConnection("r2", applied={OLD_GTID})
+    monkeypatch.setattr(app_module, "_last_write_gtid", OLD_GTID)
+
+    token = {app_module.CONSISTENCY_TOKEN_HEADER: NEW_GTID}
+    assert get_read_source(token) == "primary"
+    assert get_read_source().startswith("replica:")
+    assert app_module._replica_skip_until == [0.0, 0.0]
+
+
+def test_malformed_token_reads_from_primary_without_penalising_replicas(replicas):
+    app_module.configure_replicas("r1:3307,r2:3308")
+    replicas.servers["r1"] = FakeConnection("r1")
+    replicas.servers["r2"] = FakeConnection("r2")
+
+    assert get_read_source({app_module.CONSISTENCY_TOKEN_HEADER: "garbage"}) == "primary"
+    assert replicas.connects == []
+    assert app_module._replica_skip_until == [0.0, 0.0]
+    assert get_read_source().startswith("replica:")
+
+
+def test_failed_position_check_reads_from_primary_without_penalty(monkeypatch, replicas):
+    app_module.configure_replicas("r1:3307,r2:3308")
+    replicas.servers["r1"] = FakeConnection("r1", applied={OLD_GTID})
+    replicas.servers["r2"] = FakeConnection("r2", applied={OLD_GTID})
+    monkeypatch.setattr(app_module, "_last_write_gtid", OLD_GTID)
+    replicas.servers["r1"].check_error = app_module.MySQLdb.Error("malformed GTID")
+    replicas.servers["r2"].check_error = app_module.MySQLdb.Error("malformed GTID")
+
+    assert get_read_source() == "primary"
+    assert len(replicas.connects) == 1
+    assert app_module._replica_skip_until == [0.0, 0.0]
+
+    replicas.servers["r1"].check_error = None
+    replicas.servers["r2"].check_error = None
+    assert get_read_source().startswith("replica:")
+
+
+@pytest.mark.parametrize(
+    "token",
+    [
+        OLD_GTID,
+        f"{SOURCE_UUID}:1-5:7:9-12",
+        f"{SOURCE_UUID}:1-5,\n4c6b9a10-71ca-11e1-9e33-c80aa9429562:1",
+        f"{SOURCE_UUID}:batch:1-3",
+    ],
+)
+def test_is_gtid_set_accepts_gtid_sets(token):
+    assert app_module.is_gtid_set(token)
+
+
+@pytest.mark.parametrize(
+    "token", ["garbage", "uuid:1-5", f"{SOURCE_UUID}", f"{SOURCE_UUID}:1-x", "' OR 1"]
+)
+def test_is_gtid_set_rejects_malformed_tokens(token):
+    assert not app_module.is_gtid_set(token)
+
+
+def test_unreachable_replica_falls_back_to_primary_and_is_skipped(replicas):
+    app_module.configure_replicas("r1:3307,r2:3308")
+    replicas.servers["r1"] = None
+    replicas.servers["r2"] = None
+
+    assert get_read_source() == "primary"
+    assert get_read_source() == "primary"
+    assert sorted(replicas.connects) == ["r1", "r2"]
+
+
+def test_unreachable_replica_is_skipped_in_favour_of_healthy_one(replicas):
+    app_module.configure_replicas("r1:3307,r2:3308")
+    replicas.servers["r1"] = None
+    replicas.servers["r2"] = FakeConnection("r2")
+
+    assert get_read_source() == "replica:r2:3308"
+    assert get_read_source() == "replica:r2:3308"
+    assert replicas.connects.count("r1") == 1
+
+
+def test_client_token_takes_precedence_over_last_write(monkeypatch, replicas):
+    app_module.configure_replicas("r1:3307")
+    replicas.servers["r1"] = FakeConnection("r1", applied={OLD_GTID})
+    monkeypatch.setattr(app_module, "_last_write_gtid", NEW_GTID)
+
+    source = get_read_source({app_module.CONSISTENCY_TOKEN_HEADER: OLD_GTID})
+    assert source == "replica:r1:3307"
+
+
+def test_commit_records_write_position(primary, replicas):
+    app_module.configure_replicas("r1:3307")
+    with app_module.app.test_request_context(method="POST"):
+        app_module.commit_primary()
+        assert app_module.g.consistency_token == NEW_GTID
+    assert app_module._last_write_gtid == NEW_GTID
+    assert app_module._last_write_unknown is False
+
+
+@pytest.mark.parametrize("gtid_executed", ["", None])
+def test_unknown_write_position_forces_primary(primary, replicas, gtid_executed):
+    app_module.configure_replicas("r1:3307")
+    replicas.servers["r1"] = FakeConnection("r1")
+    primary.gtid_executed = gtid_executed
+    with app_module.app.test_request_context(method="POST"):
+        app_module.commit_primary()
+        assert "consistency_token" not in app_module.g
+
+    assert get_read_source() == "primary"
+    assert replicas.connects == []
+
+
+def test_failed_position_query_forces_primary(monkeypatch, primary, replicas):
+    app_module.configure_replicas("r1:3307")
+    replicas.servers["r1"] = FakeConnection("r1", applied={OLD_GTID})
+    monkeypatch.setattr(app_module, "_last_write_gtid", OLD_GTID)
+
+    class BrokenCursor(FakeCursor):
+        def execute(self, sql, params=()):
+            raise app_module.MySQLdb.Error("lost connection")
+
+    with app_module.app.test_request_context(method="POST"):
+        monkeypatch.setattr(primary, "cursor", lambda: BrokenCursor(primary))
+        app_module.commit_primary()
+    monkeypatch.setattr(primary, "cursor", lambda: FakeCursor(primary))
+
+    assert app_module._last_write_unknown is True
+    assert get_read_source() == "primary"
+    assert replicas.connects == []